@@ -1,17 +1,27 @@
 import os
-import json
+import atexit
 import time
 import hmac
 import hashlib
 import logging
 import sys
 import asyncio
-from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Any
+import random
+import uuid
+from datetime import date, datetime, timezone, timedelta
+from functools import lru_cache
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Deque, Tuple
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-import requests
+from telegram.request import HTTPXRequest
+import aiohttp
+import orjson
 import calendar as cal
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
 
 # Configure logging
 logging.basicConfig(
@@ -25,6 +35,7 @@ logger = logging.getLogger(__name__)
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TRACKER_TOKEN = os.getenv('YANDEX_TRACKER_TOKEN')
 CURRENT_USER = os.getenv('CURRENT_USER', 'XXXXXXX')
+WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')  # secret_token passed to setWebhook
 
 # Define the audience and region choices with emojis
 AUDIENCE_CHOICES = [
@@ -35,6 +46,12 @@ AUDIENCE_CHOICES = [
 
 DONE_SELECTION = "✅ Done"
 
+# Sent when Tracker reports the ticket exists but it could not be looked up
+DUPLICATE_TASK_MESSAGE = (
+    "⚠️ The task may already have been created.\n"
+    "Please check the queue before creating it again."
+)
+
 REGION_CHOICES = [
     "🌎 All regions",           # Americas-focused globe
     "🌍 South&Central Africa",  # Europe/Africa-focused globe
@@ -46,6 +63,15 @@ REGION_CHOICES = [
     "❓ I don't know"           # Question mark for unknown
 ]
 
+# Lookups between a choice as shown on the keyboard and its text without the emoji
+AUDIENCE_EMOJI_BY_CLEAN = {choice.partition(' ')[2]: choice for choice in AUDIENCE_CHOICES}
+AUDIENCE_CLEAN_BY_EMOJI = {choice: clean for clean, choice in AUDIENCE_EMOJI_BY_CLEAN.items()}
+REGION_EMOJI_BY_CLEAN = {choice.partition(' ')[2]: choice for choice in REGION_CHOICES}
+REGION_CLEAN_BY_EMOJI = {choice: clean for clean, choice in REGION_EMOJI_BY_CLEAN.items()}
+# Choices as rendered in the ticket description
+AUDIENCE_MD_BY_CLEAN = {clean: f"```{choice}```" for clean, choice in AUDIENCE_EMOJI_BY_CLEAN.items()}
+REGION_MD_BY_CLEAN = {clean: f"```{choice}```" for clean, choice in REGION_EMOJI_BY_CLEAN.items()}
+
 # Common questions that appear after region selection (except All regions)
 REGION_SPECIFIC_QUESTIONS = [
     "Which country?",
@@ -67,6 +93,14 @@ FINAL_QUESTIONS = [
     "What types of communications you would like to use in this task?"
 ]
 
+# Questions whose answers are copied into the ticket description, in order
+_ALL_QUESTIONS = tuple(COMMON_QUESTIONS + FINAL_QUESTIONS)
+
+# Question queues after region selection. FormState only moves a cursor over
+# its queue, so these tuples are shared as they are
+_QUEUE_ALL = tuple(COMMON_QUESTIONS + FINAL_QUESTIONS)
+_QUEUE_REGION = tuple(REGION_SPECIFIC_QUESTIONS + COMMON_QUESTIONS + FINAL_QUESTIONS)
+
 # Communication type choices
 USER_COMMUNICATION_TYPES = [
     "📱 Push",
@@ -95,6 +129,13 @@ DRIVER_COMMUNICATION_TYPES = [
     "❓ I don't know"
 ]
 
+# For membership checks, the lists above keep the keyboard order
+USER_COMMUNICATION_TYPES_SET = frozenset(USER_COMMUNICATION_TYPES)
+DRIVER_COMMUNICATION_TYPES_SET = frozenset(DRIVER_COMMUNICATION_TYPES)
+
+# Communication types as rendered in the ticket description
+COMM_TYPE_MD = {comm_type: f"```{comm_type}```" for comm_type in USER_COMMUNICATION_TYPES + DRIVER_COMMUNICATION_TYPES}
+
 # Navigation buttons
 NAVIGATION_BUTTONS = [
     "⬅️ Go back",
@@ -114,9 +155,26 @@ COUNTRY_FLAGS = {
     "United Kingdom": "🇬🇧"
     # Add more countries as needed
 }
+# Country flags keyed by casefolded name, so answers like " russia" still match
+_COUNTRY_FLAGS_NORM = {country.casefold().strip(): flag for country, flag in COUNTRY_FLAGS.items()}
+
+# Store user states, least recently active first
+MAX_SESSIONS = 10_000  # Abandoned sessions beyond this are dropped
+user_states: "OrderedDict[int, dict]" = OrderedDict()
+
+def get_user_state(user_id: int) -> dict:
+    """Return the user's session, marking it as recently used"""
+    session = user_states.get(user_id)
+    if session is not None:
+        user_states.move_to_end(user_id)
+    return session
 
-# Store user states
-user_states = {}
+def set_user_state(user_id: int, session: dict):
+    """Store the user's session, evicting the least recently used ones over the limit"""
+    user_states[user_id] = session
+    user_states.move_to_end(user_id)
+    while len(user_states) > MAX_SESSIONS:
+        user_states.popitem(last=False)
 
 def get_current_time_utc():
     """Get current UTC time in YYYY-MM-DD HH:MM:SS format"""
@@ -124,9 +182,8 @@ def get_current_time_utc():
 
 def calculate_priority(deadline_str: str) -> str:
     """Calculate priority based on deadline"""
-    deadline = datetime.strptime(deadline_str, '%Y-%m-%d').replace(tzinfo=timezone.utc)
-    now = datetime.now(timezone.utc)
-    days_until_deadline = (deadline - now).days
+    # Full days left before the deadline day starts in UTC, as (deadline - now).days gave
+    days_until_deadline = date.fromisoformat(deadline_str).toordinal() - datetime.now(timezone.utc).toordinal() - 1
     
     if days_until_deadline < 3:
         return "blocker"
@@ -137,49 +194,95 @@ def calculate_priority(deadline_str: str) -> str:
     else:
         return "normal"      # Changed from "low" to "normal"
 
+class DuplicateIssueError(Exception):
+    """Tracker rejected the issue because one with the same unique value already exists"""
+
 class YandexTracker:
     BASE_URL = "https://st-api.yandex-team.ru"
     DEFAULT_QUEUE = "YANGOCRM"
     METADATA_URL = "XXXXXXX"
+    IAM_TOKEN_REFRESH_MARGIN = 60  # Refresh the IAM token this many seconds before it expires
+    METADATA_TIMEOUT = aiohttp.ClientTimeout(total=3.05)
+    API_TIMEOUT = aiohttp.ClientTimeout(connect=3.05, total=30)
+    MAX_CONCURRENT_REQUESTS = 16
+    MAX_RETRIES = 5
+    MAX_RETRY_DELAY = 30  # Seconds
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    DUPLICATE_STATUS = 409  # Returned when an issue with the same unique value exists
+    # The HTTP session, token lock and request semaphore belong to the running
+    # event loop and are shared by all instances; see open_session/close_session
+    _session: aiohttp.ClientSession = None
+    _iam_lock: asyncio.Lock = None
+    _request_sem: asyncio.Semaphore = None
+    _iam_token = None
+    _iam_expiry = 0.0
     
     def __init__(self):
         self.current_user = os.getenv('CURRENT_USER', 'XXXXX')
-        self.current_time = datetime.strptime("2025-06-09 14:49:11", "%Y-%m-%d %H:%M:%S")
-        logger.info(f"Initialized YandexTracker client for user: {self.current_user}")
+        logger.info("Initialized YandexTracker client for user: %s", self.current_user)
 
-    def _get_iam_token(self):
-        try:
-            logger.info("Attempting to get IAM token from metadata service...")
-            headers = {
-                "Metadata-Flavor": "Google"  # Required header for metadata service
-            }
-            
-            response = requests.get(
-                self.METADATA_URL,
-                headers=headers,
-                timeout=3.05
+    @classmethod
+    async def open_session(cls):
+        """Create the HTTP session that keeps connections to Tracker and metadata alive"""
+        if cls._session is None or cls._session.closed:
+            cls._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=64, keepalive_timeout=300),
+                headers={"Content-Type": "application/json"}
             )
-            
-            if response.ok:
-                token_data = response.json()
-                return token_data.get('access_token')
-            else:
-                raise Exception(f"Metadata service returned status {response.status_code}")
+            cls._iam_lock = asyncio.Lock()
+            cls._request_sem = asyncio.Semaphore(cls.MAX_CONCURRENT_REQUESTS)
+
+    @classmethod
+    async def close_session(cls):
+        """Close the HTTP session before its event loop goes away"""
+        if cls._session is not None:
+            await cls._session.close()
+            cls._session = None
+
+    async def _get_iam_token(self):
+        """Return a cached IAM token, fetching a new one from metadata only when it is about to expire"""
+        cls = type(self)
+        if cls._iam_token and time.monotonic() < cls._iam_expiry - self.IAM_TOKEN_REFRESH_MARGIN:
+            return cls._iam_token
+
+        async with cls._iam_lock:
+            # Another caller may have refreshed the token while we were waiting
+            if cls._iam_token and time.monotonic() < cls._iam_expiry - self.IAM_TOKEN_REFRESH_MARGIN:
+                return cls._iam_token
+            try:
+                logger.info("Attempting to get IAM token from metadata service...")
+                headers = {
+                    "Metadata-Flavor": "Google"  # Required header for metadata service
+                }
                 
-        except Exception as e:
-            logger.error(f"Error getting IAM token: {e}")
-            raise
+                async with self._session.get(
+                    self.METADATA_URL,
+                    headers=headers,
+                    timeout=self.METADATA_TIMEOUT
+                ) as response:
+                    if response.ok:
+                        token_data = orjson.loads(await response.read())
+                        cls._iam_token = token_data.get('access_token')
+                        cls._iam_expiry = time.monotonic() + token_data.get('expires_in', 3600)
+                        return cls._iam_token
+                    else:
+                        raise Exception(f"Metadata service returned status {response.status}")
+                    
+            except Exception as e:
+                logger.error("Error getting IAM token: %s", e)
+                raise
 
-    def create_issue(self, queue, summary, description, priority="normal", assignee=None):
+    async def create_issue(self, queue, summary, description, priority="normal", assignee=None):
         try:
-            iam_token = self._get_iam_token()
+            iam_token = await self._get_iam_token()
+            created_at = datetime.now(timezone.utc)
             
             headers = {
                 "Authorization": f"Bearer {iam_token}",
-                "Content-Type": "application/json",
                 "X-Ya-User-Login": self.current_user
             }
 
+            unique = str(uuid.uuid4())
             data = {
                 "queue": queue or self.DEFAULT_QUEUE,
                 "summary": summary,
@@ -187,7 +290,8 @@ class YandexTracker:
                 "type": {"name": "Task"},
                 "priority": priority,
                 "createdBy": self.current_user,
-                "createdAt": self.current_time.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+                "createdAt": created_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "unique": unique  # Lets Tracker reject duplicates when a request is retried
             }
             
             if assignee:
@@ -195,39 +299,96 @@ class YandexTracker:
 
             endpoint = f"{self.BASE_URL}/v2/issues/"
             
-            logger.info(f"Creating issue at {self.current_time.strftime('%Y-%m-%d %H:%M:%S UTC')}")
-            logger.info(f"Queue: {queue or self.DEFAULT_QUEUE}")
-            logger.info(f"User: {self.current_user}")
-            logger.info(f"Request data: {json.dumps(data, ensure_ascii=False, indent=2)}")
-            
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=data,
-                timeout=(3.05, 27)
-            )
-            
-            logger.info(f"Response status code: {response.status_code}")
-            
-            if not response.ok:
-                try:
-                    error_data = response.json()
-                    logger.error(f"Error response data: {json.dumps(error_data, ensure_ascii=False, indent=2)}")
-                    error_message = self._format_error_message(error_data)
-                except:
-                    error_message = response.text
-                    logger.error(f"Raw error response: {response.text}")
-                
-                raise Exception(f"API Error ({response.status_code}): {error_message}")
+            logger.info("Creating issue at %s", created_at.strftime('%Y-%m-%d %H:%M:%S UTC'))
+            logger.info("Queue: %s", queue or self.DEFAULT_QUEUE)
+            logger.info("User: %s", self.current_user)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Request data: %s", orjson.dumps(data).decode())
             
-            response_data = response.json()
-            logger.info(f"Successfully created issue: {json.dumps(response_data, ensure_ascii=False, indent=2)}")
+            try:
+                # Serialised once and reused by every retry
+                response_data = await self._post_with_retry(endpoint, headers, orjson.dumps(data))
+            except DuplicateIssueError:
+                # An earlier attempt went through but its response was lost
+                response_data = await self._find_issue_by_unique(headers, unique)
+                if response_data is None:
+                    raise
+            logger.info("Successfully created issue: %s", response_data.get('key'))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response data: %s", orjson.dumps(response_data).decode())
             return response_data
             
         except Exception as e:
-            logger.error(f"Error creating issue: {str(e)}")
+            logger.error("Error creating issue: %s", e)
             raise
 
+    async def _post_with_retry(self, endpoint, headers, body):
+        """POST to Tracker, retrying throttled, failed and timed out requests with exponential backoff"""
+        for attempt in range(self.MAX_RETRIES + 1):
+            retry_after = None
+            try:
+                async with self._request_sem:
+                    async with self._session.post(
+                        endpoint,
+                        headers=headers,
+                        data=body,  # Session sends it as application/json
+                        timeout=self.API_TIMEOUT
+                    ) as response:
+                        logger.info("Response status code: %s", response.status)
+                        
+                        if response.status in self.RETRY_STATUSES and attempt < self.MAX_RETRIES:
+                            retry_after = response.headers.get('Retry-After')
+                        elif response.status == self.DUPLICATE_STATUS:
+                            raise DuplicateIssueError("An issue with the same unique value already exists")
+                        elif not response.ok:
+                            raw = await response.read()
+                            response_text = raw.decode('utf-8', 'replace')
+                            logger.error("Error response data: %s", response_text)
+                            try:
+                                error_message = self._format_error_message(orjson.loads(raw))
+                            except (orjson.JSONDecodeError, AttributeError, TypeError):
+                                # Not JSON, or not in one of the known error shapes
+                                error_message = response_text
+                            
+                            raise Exception(f"API Error ({response.status}): {error_message}")
+                        else:
+                            return orjson.loads(await response.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                logger.warning("Request to Tracker failed: %r", e)
+            
+            delay = self._retry_delay(attempt, retry_after)
+            logger.warning("Retrying Tracker request in %.1fs (attempt %d of %d)", delay, attempt + 1, self.MAX_RETRIES)
+            await asyncio.sleep(delay)
+
+    async def _find_issue_by_unique(self, headers, unique):
+        """Return the issue created with the given unique value, or None if it cannot be found"""
+        try:
+            async with self._session.post(
+                f"{self.BASE_URL}/v2/issues/_search",
+                headers=headers,
+                data=orjson.dumps({"filter": {"unique": unique}}),
+                timeout=self.API_TIMEOUT
+            ) as response:
+                if response.ok:
+                    issues = orjson.loads(await response.read())
+                    if issues:
+                        return issues[0]
+                logger.warning("Existing issue not found by unique value, status %s", response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Could not look up the existing issue: %r", e)
+        return None
+
+    def _retry_delay(self, attempt, retry_after=None):
+        """Seconds to wait before the next attempt, honouring Retry-After when Tracker sends it"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.MAX_RETRY_DELAY)
+            except ValueError:
+                pass
+        return min(2 ** attempt + random.random(), self.MAX_RETRY_DELAY)
+
     def _format_error_message(self, error_data):
         if isinstance(error_data, dict):
             if 'errors' in error_data:
@@ -238,97 +399,161 @@ class YandexTracker:
                 return error_data['message']
         return str(error_data)
 
+# Holds no per-request state, so every ticket goes through the same client
+TRACKER = YandexTracker()
+
+# Fields restored by FormState.go_back. Containers among them are replaced, never
+# mutated in place, so a checkpoint can hold references instead of copies.
+UNDO_FIELDS = (
+    'current_question',
+    'selected_audience',
+    'selected_region',
+    'questions_queue',
+    'question_index',
+    'awaiting_deadline',
+    'awaiting_communication_types',
+    'communication_types',
+    'all_questions_answered'
+)
+MAX_UNDO_STEPS = 32  # How many times a user can go back in a row
+_MISSING = object()  # Marks answers that did not exist when a checkpoint was taken
+
 class FormState:
+    __slots__ = (
+        'answers',
+        'current_question',
+        'selected_audience',
+        'selected_region',
+        'questions_queue',
+        'question_index',
+        'awaiting_deadline',
+        'current_calendar_year',
+        'current_calendar_month',
+        'previous_states',
+        'awaiting_communication_types',
+        'communication_types',
+        'comm_types',
+        'comm_kb',
+        'all_questions_answered',
+        'is_empty_ticket'
+    )
+
     def __init__(self):
         self.answers: Dict[str, Any] = {}
         self.current_question: str = None
         self.selected_audience: bool = False
         self.selected_region: str = None
-        self.questions_queue: List[str] = []
+        self.questions_queue: Tuple[str, ...] = ()
+        self.question_index: int = 0  # Position of the next question in questions_queue
         self.awaiting_deadline: bool = False
         self.current_calendar_year: int = datetime.now().year
         self.current_calendar_month: int = datetime.now().month
-        self.previous_states: List[Dict] = []
+        self.previous_states: Deque[Tuple[tuple, Dict[str, Any]]] = deque(maxlen=MAX_UNDO_STEPS)
         self.awaiting_communication_types: bool = False
-        self.communication_types: List[str] = []
+        self.communication_types: Tuple[str, ...] = ()
+        # Communication types offered for the chosen audience, set when the audience is confirmed
+        self.comm_types: frozenset = frozenset()
+        self.comm_kb: ReplyKeyboardMarkup = None
         self.all_questions_answered: bool = False
         self.is_empty_ticket: bool = False  # New flag for empty ticket flow
 
     def save_state(self):
         """Save current state for going back"""
-        state_copy = {
-            'answers': self.answers.copy(),
-            'current_question': self.current_question,
-            'selected_audience': self.selected_audience,
-            'selected_region': self.selected_region,
-            'questions_queue': self.questions_queue.copy() if self.questions_queue else [],
-            'awaiting_deadline': self.awaiting_deadline,
-            'awaiting_communication_types': self.awaiting_communication_types,
-            'communication_types': self.communication_types.copy() if self.communication_types else [],
-            'all_questions_answered': self.all_questions_answered  # Save the new flag
-        }
-        self.previous_states.append(state_copy)
+        # Answers are not copied: set_answer logs the values it overwrites instead
+        fields = tuple(getattr(self, field) for field in UNDO_FIELDS)
+        self.previous_states.append((fields, {}))
+
+    def set_answer(self, key: str, value: Any):
+        """Store an answer, remembering the previous value for going back"""
+        if self.previous_states:
+            self.previous_states[-1][1].setdefault(key, self.answers.get(key, _MISSING))
+        self.answers[key] = value
 
     def go_back(self) -> bool:
         """Restore previous state. Returns True if successful, False if no previous state"""
         if not self.previous_states:
             return False
         
-        previous_state = self.previous_states.pop()
-        self.answers = previous_state['answers']
-        self.current_question = previous_state['current_question']
-        self.selected_audience = previous_state['selected_audience']
-        self.selected_region = previous_state['selected_region']
-        self.questions_queue = previous_state['questions_queue']
-        self.awaiting_deadline = previous_state['awaiting_deadline']
-        self.awaiting_communication_types = previous_state['awaiting_communication_types']
-        self.communication_types = previous_state['communication_types']
-        self.all_questions_answered = previous_state.get('all_questions_answered', False)  # Restore the new flag
+        fields, old_answers = self.previous_states.pop()
+        for field, value in zip(UNDO_FIELDS, fields):
+            setattr(self, field, value)
+        for key, value in old_answers.items():
+            if value is _MISSING:
+                self.answers.pop(key, None)
+            else:
+                self.answers[key] = value
         return True
 
+    def set_questions(self, questions: Tuple[str, ...]):
+        """Start asking the given questions from the first one"""
+        self.questions_queue = questions
+        self.question_index = 0
+
     def get_next_question(self) -> str:
-        if not self.questions_queue:
+        if self.question_index >= len(self.questions_queue):
             self.all_questions_answered = True
             return None
-        self.current_question = self.questions_queue.pop(0)
+        self.current_question = self.questions_queue[self.question_index]
+        self.question_index += 1
         return self.current_question
 
 def get_keyboard_markup(choices: List[str]) -> ReplyKeyboardMarkup:
     keyboard = [[choice] for choice in choices]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+# Keyboards are built once, Telegram objects are immutable and safe to share
+KB_MAIN_MENU = ReplyKeyboardMarkup([['📝 Create Task', '📄 Empty ticket']], resize_keyboard=True)
+KB_CREATE_TASK = get_keyboard_markup(['📝 Create Task'])
+KB_TASK_CHOICES = get_keyboard_markup(['📝 Create Task', '📄 Empty ticket'])
+KB_NAV_ONLY = get_keyboard_markup(NAVIGATION_BUTTONS)
+KB_AUDIENCE = get_keyboard_markup(AUDIENCE_CHOICES + [DONE_SELECTION] + NAVIGATION_BUTTONS)
+KB_REGION = get_keyboard_markup(REGION_CHOICES + NAVIGATION_BUTTONS)
+KB_USER_COMMS = get_keyboard_markup(USER_COMMUNICATION_TYPES + [DONE_SELECTION] + NAVIGATION_BUTTONS)
+KB_DRIVER_COMMS = get_keyboard_markup(DRIVER_COMMUNICATION_TYPES + [DONE_SELECTION] + NAVIGATION_BUTTONS)
+
+MONTH_NAMES = ('January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December')
+# Days of week header, shared by every calendar
+CALENDAR_HEADER_ROW = tuple(InlineKeyboardButton(day, callback_data="ignore")
+                            for day in ('Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su'))
+# Cells that cannot be selected look the same in every calendar
+EMPTY_BTN = InlineKeyboardButton(" ", callback_data="ignore")
+DISABLED_BTN = InlineKeyboardButton("✖", callback_data="ignore")
+
+@lru_cache(maxsize=64)
+def _month_grid(year: int, month: int) -> Tuple[Tuple[int, ...], ...]:
+    """Weeks of the month as day numbers, 0 for days outside the month"""
+    return tuple(tuple(week) for week in cal.monthcalendar(year, month))
+
 def create_calendar_keyboard(year: int, month: int) -> InlineKeyboardMarkup:
     """Create an inline keyboard with a calendar"""
+    return _calendar_markup(year, month, datetime.now(timezone.utc).toordinal())
+
+@lru_cache(maxsize=64)
+def _calendar_markup(year: int, month: int, today_ord: int) -> InlineKeyboardMarkup:
+    """Build the calendar for a month as seen on the given day, markups are immutable and cached"""
     keyboard = []
     
     # Add month and year at the top
-    month_names = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
-                  'August', 'September', 'October', 'November', 'December']
-    keyboard.append([InlineKeyboardButton(f"{month_names[month-1]} {year}",
+    keyboard.append([InlineKeyboardButton(f"{MONTH_NAMES[month-1]} {year}",
                                         callback_data="ignore")])
     
     # Add days of week as header
-    days_of_week = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']
-    keyboard.append([InlineKeyboardButton(day, callback_data="ignore") for day in days_of_week])
-    
-    # Get the calendar for current month
-    month_calendar = cal.monthcalendar(year, month)
+    keyboard.append(CALENDAR_HEADER_ROW)
     
-    # Add calendar days
-    today = datetime.now(timezone.utc).date()
-    for week in month_calendar:
+    # Add calendar days, comparing dates as ordinals to avoid building date objects
+    first_ord = datetime(year, month, 1).toordinal()
+    for week in _month_grid(year, month):
         row = []
         for day in week:
             if day == 0:
-                row.append(InlineKeyboardButton(" ", callback_data="ignore"))
+                row.append(EMPTY_BTN)
+            elif first_ord + day - 1 < today_ord:
+                # Past dates are disabled
+                row.append(DISABLED_BTN)
             else:
-                date = datetime(year, month, day).date()
-                if date < today:
-                    # Past dates are disabled
-                    row.append(InlineKeyboardButton("✖", callback_data="ignore"))
-                else:
-                    date_str = f"{year}-{month:02d}-{day:02d}"
-                    row.append(InlineKeyboardButton(str(day), callback_data=f"date_{date_str}"))
+                date_str = f"{year}-{month:02d}-{day:02d}"
+                row.append(InlineKeyboardButton(str(day), callback_data=f"date_{date_str}"))
         keyboard.append(row)
     
     # Add navigation buttons at the bottom
@@ -351,81 +576,108 @@ def create_calendar_keyboard(year: int, month: int) -> InlineKeyboardMarkup:
     
     return InlineKeyboardMarkup(keyboard)
 
+async def send_md(update: Update, text: str, markup):
+    """Reply to the update's message with Markdown formatting"""
+    await update.message.reply_text(text, parse_mode='Markdown', reply_markup=markup)
+
+async def send_md_bold(update: Update, text: str, markup):
+    """Reply to the update's message with the text in bold"""
+    await send_md(update, f"*{text}*", markup)
+
+async def reply_selected(update: Update, choice: str):
+    """Confirm a multi-select choice, the keyboard from the prompt stays on screen"""
+    await update.message.reply_text(f"Selected: {choice}\nYou can select more or click '{DONE_SELECTION}'")
+
+def build_description(form_state: FormState) -> str:
+    """Build the ticket description from the answers of a filled in form"""
+    answers = form_state.answers
+    parts = [
+        f"Current Date and Time (UTC - YYYY-MM-DD HH:MM:SS formatted): {get_current_time_utc()}",
+        f"Current User's Login: {CURRENT_USER}",
+        f"\n⏰ Deadline: {answers['deadline']}",
+        f"⚡ Priority: {answers['priority'].upper()}\n"
+    ]
+    
+    # Add audience with emojis
+    parts.append("*For what audience is the communication planned?*")
+    parts.extend(AUDIENCE_MD_BY_CLEAN[aud] for aud in answers['audience'])
+    
+    # Add region with emoji
+    parts.append("\n*Selected region:*")
+    parts.append(REGION_MD_BY_CLEAN[answers['region']])
+    
+    # Add country with flag if provided
+    if "Which country?" in answers:
+        country = answers["Which country?"]
+        flag = _COUNTRY_FLAGS_NORM.get(country.casefold().strip(), "")
+        parts.append(f"\n*Country:* {flag}{country}")
+    
+    # Add city if provided
+    if "Which city?" in answers:
+        parts.append(f"\n*City:* {answers['Which city?']}")
+    
+    # Add all other Q&A
+    for question in _ALL_QUESTIONS:
+        if question in answers:
+            parts.append(f"\n*{question}*")
+            if question == "What types of communications you would like to use in this task?":
+                parts.extend(COMM_TYPE_MD[ct] for ct in answers[question])  # Stored as the selected tuple
+            else:
+                parts.append(answers[question])
+    
+    return "\n".join(parts)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler"""
-    keyboard = [
-        ['📝 Create Task', '📄 Empty ticket']  # Added new button
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text(
+    await send_md(
+        update,
         "Hello! I can help you create tasks in Yandex Tracker for Yango CRM Team.\nNOTE!This bot for only fast creation of tasks without access to tracker from your laptop. For big detailed projects please use our [Yandex Tracker queue](https://st.yandex-team.ru/createTicket?queue=YANGOCRM)\nChoose an action:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
+        KB_MAIN_MENU
     )
-    user_states[update.effective_user.id] = {}
+    set_user_state(update.effective_user.id, {})
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel current operation"""
     user_id = update.effective_user.id
-    user_states[user_id] = {}
-    keyboard = [['📝 Create Task']]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text(
-        "Operation cancelled. What would you like to do?",
-        reply_markup=reply_markup
-    )
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Cancel current operation"""
-    user_id = update.effective_user.id
-    user_states[user_id] = {}
-    keyboard = [['📝 Create Task']]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    set_user_state(user_id, {})
     await update.message.reply_text(
         "Operation cancelled. What would you like to do?",
-        reply_markup=reply_markup
+        reply_markup=KB_CREATE_TASK
     )
 
 async def handle_back(update: Update, context: ContextTypes.DEFAULT_TYPE):  # Move this to the same level as other async functions
     """Handle going back to previous state"""
     user_id = update.effective_user.id
-    if user_id not in user_states or 'form_state' not in user_states[user_id]:
+    session = get_user_state(user_id)
+    if not session or 'form_state' not in session:
         await start(update, context)
         return True
 
-    form_state = user_states[user_id]['form_state']
+    form_state = session['form_state']
     if form_state.go_back():
         # Determine appropriate message and keyboard based on current state
         if not form_state.selected_audience:
-            await update.message.reply_text(
+            await send_md(
+                update,
                 "*For what audience is the communication planned?*\nSelect one or more options:",
-                parse_mode='Markdown',
-                reply_markup=get_keyboard_markup(AUDIENCE_CHOICES + [DONE_SELECTION] + NAVIGATION_BUTTONS)
+                KB_AUDIENCE
             )
         elif not form_state.selected_region:
-            await update.message.reply_text(
-                "*Select regions:*\nSelect one option:",
-                parse_mode='Markdown',
-                reply_markup=get_keyboard_markup(REGION_CHOICES + NAVIGATION_BUTTONS)
-            )
+            await send_md(update, "*Select regions:*\nSelect one option:", KB_REGION)
         elif form_state.awaiting_deadline:
-            await update.message.reply_text(
+            await send_md(
+                update,
                 "*Select deadline:*",
-                parse_mode='Markdown',
-                reply_markup=create_calendar_keyboard(form_state.current_calendar_year, form_state.current_calendar_month)
+                create_calendar_keyboard(form_state.current_calendar_year, form_state.current_calendar_month)
             )
         elif form_state.awaiting_communication_types:
-            comm_types = USER_COMMUNICATION_TYPES if "Users" in form_state.answers.get('audience', []) else DRIVER_COMMUNICATION_TYPES
-            await update.message.reply_text(
+            await send_md(
+                update,
                 "*Select communication types:*\nYou can select multiple options:",
-                parse_mode='Markdown',
-                reply_markup=get_keyboard_markup(comm_types + [DONE_SELECTION] + NAVIGATION_BUTTONS)
+                form_state.comm_kb
             )
         else:
-            await update.message.reply_text(
-                f"*{form_state.current_question}*",
-                parse_mode='Markdown',
-                reply_markup=get_keyboard_markup(NAVIGATION_BUTTONS)
-            )
+            await send_md_bold(update, form_state.current_question, KB_NAV_ONLY)
         return True
     return False
 
@@ -434,41 +686,37 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     
-    if user_id not in user_states or 'form_state' not in user_states[user_id]:
+    session = get_user_state(user_id)
+    if not session or 'form_state' not in session:
         await query.answer()
         return
     
-    form_state = user_states[user_id]['form_state']
+    form_state = session['form_state']
     
     if not form_state.awaiting_deadline:
         await query.answer()
         return
 
+    answered = False
     try:
-        await query.answer()  # Answer callback query to remove loading state
-        
-        if query.data == "ignore":
-            return
-        
         if query.data.startswith("date_"):
-            form_state.save_state()  # Save state before making changes
             selected_date = query.data[5:]  # Remove "date_" prefix
             
-            # Validate that selected date is not in the past
+            # Validate that selected date is not in the past, the calendar stays on screen
             selected_datetime = datetime.strptime(selected_date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
             if selected_datetime.date() < datetime.now(timezone.utc).date():
-                await query.message.reply_text(
-                    "❌ Cannot select a date in the past. Please choose a future date.",
-                    reply_markup=create_calendar_keyboard(form_state.current_calendar_year, form_state.current_calendar_month)
-                )
+                await query.answer("❌ Cannot select a date in the past. Please choose a future date.", show_alert=True)
                 return
             
-            form_state.answers['deadline'] = selected_date
+            await query.answer()  # Answer callback query to remove loading state
+            answered = True
+            form_state.save_state()  # Save state before making changes
+            form_state.set_answer('deadline', selected_date)
             form_state.awaiting_deadline = False
             
             # Calculate and store priority
             priority = calculate_priority(selected_date)
-            form_state.answers['priority'] = priority
+            form_state.set_answer('priority', priority)
             
             # Delete the calendar message
             await query.message.delete()
@@ -480,55 +728,10 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             # Create the task after deadline is set
             try:
-                tracker = YandexTracker()
-                description_parts = [
-                    f"Current Date and Time (UTC - YYYY-MM-DD HH:MM:SS formatted): {get_current_time_utc()}",
-                    f"Current User's Login: {CURRENT_USER}",
-                    f"\n⏰ Deadline: {form_state.answers['deadline']}",
-                    f"⚡ Priority: {form_state.answers['priority'].upper()}\n"
-                ]
-                
-                # Add audience with emojis
-                description_parts.append("*For what audience is the communication planned?*")
-                audience_with_emojis = []
-                for aud in form_state.answers['audience']:
-                    for choice in AUDIENCE_CHOICES:
-                        if aud in choice:
-                            audience_with_emojis.append(f"```{choice}```")
-                            break
-                description_parts.append("\n".join(audience_with_emojis))
-                
-                # Add region with emoji
-                description_parts.append("\n*Selected region:*")
-                for choice in REGION_CHOICES:
-                    if form_state.answers['region'] in choice:
-                        description_parts.append(f"```{choice}```")
-                        break
-                
-                # Add country with flag if provided
-                if "Which country?" in form_state.answers:
-                    country = form_state.answers["Which country?"]
-                    flag = COUNTRY_FLAGS.get(country, "")
-                    description_parts.append(f"\n*Country:* {flag}{country}")
-                
-                # Add city if provided
-                if "Which city?" in form_state.answers:
-                    description_parts.append(f"\n*City:* {form_state.answers['Which city?']}")
-                
-                # Add all other Q&A
-                for question in COMMON_QUESTIONS + FINAL_QUESTIONS:
-                    if question in form_state.answers:
-                        description_parts.append(f"\n*{question}*")
-                        if question == "What types of communications you would like to use in this task?":
-                            comm_types = form_state.answers[question].split(", ")
-                            description_parts.append("\n".join([f"```{ct}```" for ct in comm_types]))
-                        else:
-                            description_parts.append(form_state.answers[question])
-                
-                full_description = "\n".join(description_parts)
+                full_description = build_description(form_state)
                 
                 # Create issue
-                issue = tracker.create_issue(
+                issue = await TRACKER.create_issue(
                     queue='YANGOCRM',
                     summary=form_state.answers["What is the task about? (What has happened?)"][:100],
                     description=full_description,
@@ -540,309 +743,385 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         f"✅ Task created successfully!\n"
                         f"Key: {issue['key']}\n"
                         f"Link: https://st.yandex-team.ru/{issue['key']}",
-                        reply_markup=get_keyboard_markup(['📝 Create Task'])
+                        reply_markup=KB_CREATE_TASK
                     )
                 else:
                     await query.message.reply_text(
                         "❌ Failed to create task.\n"
                         "Please contact support or try again later.",
-                        reply_markup=get_keyboard_markup(['📝 Create Task'])
+                        reply_markup=KB_CREATE_TASK
                     )
                 
                 # Clear user state
-                user_states[user_id] = {}
+                set_user_state(user_id, {})
                 
+            except DuplicateIssueError:
+                logger.warning("Task was created, but it could not be looked up")
+                await query.message.reply_text(
+                    DUPLICATE_TASK_MESSAGE,
+                    reply_markup=KB_CREATE_TASK
+                )
+                set_user_state(user_id, {})
             except Exception as e:
-                logger.error(f"Error creating task: {str(e)}")
+                logger.error("Error creating task: %s", e)
                 await query.message.reply_text(
                     f"❌ Error creating task: {str(e)}",
-                    reply_markup=get_keyboard_markup(['📝 Create Task'])
+                    reply_markup=KB_CREATE_TASK
                 )
-                user_states[user_id] = {}
+                set_user_state(user_id, {})
             
         elif query.data.startswith("month_"):
             # Month navigation
+            await query.answer()
+            answered = True
             _, year, month = query.data.split("_")
             form_state.current_calendar_year = int(year)
             form_state.current_calendar_month = int(month)
             await query.message.edit_reply_markup(
                 reply_markup=create_calendar_keyboard(form_state.current_calendar_year, form_state.current_calendar_month)
             )
+        
+        else:
+            await query.answer()  # Covers "ignore" buttons
             
     except Exception as e:
-        logger.error(f"Error in callback handler: {str(e)}")
-        await query.message.reply_text(
-            "❌ An error occurred while processing your selection. Please try again.",
-            reply_markup=create_calendar_keyboard(form_state.current_calendar_year, form_state.current_calendar_month)
-        )
+        logger.error("Error in callback handler: %s", e)
+        if not answered:
+            await query.answer("❌ An error occurred while processing your selection. Please try again.", show_alert=True)
+        else:
+            # A callback query can only be answered once
+            await query.message.reply_text(
+                "❌ An error occurred while processing your selection. Please try again.",
+                reply_markup=create_calendar_keyboard(form_state.current_calendar_year, form_state.current_calendar_month)
+            )
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def start_empty_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start the empty ticket flow"""
+    set_user_state(update.effective_user.id, {
+        'form_state': FormState(),
+        'state': 'creating_empty_ticket',
+        'step': 'name'  # Start with name input
+    })
+    await update.message.reply_text(
+        "Please enter the name of the task:",
+        reply_markup=KB_NAV_ONLY
+    )
+
+async def start_task_form(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start the regular task creation flow"""
+    set_user_state(update.effective_user.id, {
+        'form_state': FormState(),
+        'state': 'collecting_data'
+    })
+    # Start with audience selection
+    await send_md(
+        update,
+        "*For what audience is the communication planned?*\nSelect one or more options:",
+        KB_AUDIENCE
+    )
+
+async def handle_empty_ticket_name(update: Update, context: ContextTypes.DEFAULT_TYPE, session: dict, message_text: str):
+    """Store the empty ticket name and ask for its description"""
+    session['task_name'] = message_text
+    session['step'] = 'description'
+    await update.message.reply_text(
+        "Please enter the description of the task:",
+        reply_markup=KB_NAV_ONLY
+    )
+
+async def handle_empty_ticket_description(update: Update, context: ContextTypes.DEFAULT_TYPE, session: dict, message_text: str):
+    """Create the empty ticket from the entered name and description"""
     user_id = update.effective_user.id
-    message_text = update.message.text
-    
-    # Handle navigation buttons
-    if message_text == "❌ Cancel":
-        await cancel(update, context)
-        return
-    elif message_text == "⬅️ Go back":
-        if await handle_back(update, context):
-            return
-    
-    if user_id not in user_states:
-        user_states[user_id] = {}
-    
-    # Handle Empty ticket creation
-    if message_text == "📄 Empty ticket":
-        form_state = FormState()
-        user_states[user_id] = {
-            'form_state': form_state,
-            'state': 'creating_empty_ticket',
-            'step': 'name'  # Start with name input
-        }
-        await update.message.reply_text(
-            "Please enter the name of the task:",
-            reply_markup=get_keyboard_markup(NAVIGATION_BUTTONS)
+    try:
+        # Create issue with minimal information
+        description_parts = [
+            f"Current Date and Time (UTC - YYYY-MM-DD HH:MM:SS formatted): {get_current_time_utc()}",
+            f"Current User's Login: {CURRENT_USER}\n",
+            message_text  # Add the description
+        ]
+        
+        issue = await TRACKER.create_issue(
+            queue='YANGOCRM',
+            summary=session['task_name'][:100],
+            description="\n".join(description_parts),
+            priority="normal"  # Default priority for empty tickets
         )
-        return
-    
-    # Handle empty ticket creation steps
-    if user_id in user_states and user_states[user_id].get('state') == 'creating_empty_ticket':
-        if user_states[user_id]['step'] == 'name':
-            user_states[user_id]['task_name'] = message_text
-            user_states[user_id]['step'] = 'description'
+        
+        if issue:
+            await update.message.reply_text(
+                f"✅ Empty task created successfully!\n"
+                f"Key: {issue['key']}\n"
+                f"Link: https://st.yandex-team.ru/{issue['key']}",
+                reply_markup=KB_TASK_CHOICES
+            )
+        else:
             await update.message.reply_text(
-                "Please enter the description of the task:",
-                reply_markup=get_keyboard_markup(NAVIGATION_BUTTONS)
+                "❌ Failed to create task.\n"
+                "Please contact support or try again later.",
+                reply_markup=KB_TASK_CHOICES
             )
+        
+        # Clear user state
+        set_user_state(user_id, {})
+        
+    except DuplicateIssueError:
+        logger.warning("Empty task was created, but it could not be looked up")
+        await update.message.reply_text(
+            DUPLICATE_TASK_MESSAGE,
+            reply_markup=KB_TASK_CHOICES
+        )
+        set_user_state(user_id, {})
+    except Exception as e:
+        logger.error("Error creating empty task: %s", e)
+        await update.message.reply_text(
+            f"❌ Error creating task: {str(e)}",
+            reply_markup=KB_TASK_CHOICES
+        )
+        set_user_state(user_id, {})
+
+async def handle_audience(update: Update, form_state: FormState, message_text: str):
+    """Handle audience selection"""
+    if 'audience' not in form_state.answers:
+        # Initial audience selection
+        if message_text in AUDIENCE_CLEAN_BY_EMOJI:
+            form_state.save_state()
+            clean_text = AUDIENCE_CLEAN_BY_EMOJI[message_text]
+            form_state.set_answer('audience', [clean_text])
+            await reply_selected(update, message_text)
             return
-        elif user_states[user_id]['step'] == 'description':
-            try:
-                # Create issue with minimal information
-                tracker = YandexTracker()
-                description_parts = [
-                    f"Current Date and Time (UTC - YYYY-MM-DD HH:MM:SS formatted): {get_current_time_utc()}",
-                    f"Current User's Login: {CURRENT_USER}\n",
-                    message_text  # Add the description
-                ]
-                
-                issue = tracker.create_issue(
-                    queue='YANGOCRM',
-                    summary=user_states[user_id]['task_name'][:100],
-                    description="\n".join(description_parts),
-                    priority="normal"  # Default priority for empty tickets
-                )
-                
-                if issue:
-                    await update.message.reply_text(
-                        f"✅ Empty task created successfully!\n"
-                        f"Key: {issue['key']}\n"
-                        f"Link: https://st.yandex-team.ru/{issue['key']}",
-                        reply_markup=get_keyboard_markup(['📝 Create Task', '📄 Empty ticket'])
-                    )
-                else:
-                    await update.message.reply_text(
-                        "❌ Failed to create task.\n"
-                        "Please contact support or try again later.",
-                        reply_markup=get_keyboard_markup(['📝 Create Task', '📄 Empty ticket'])
-                    )
-                
-                # Clear user state
-                user_states[user_id] = {}
-                
-            except Exception as e:
-                logger.error(f"Error creating empty task: {str(e)}")
+    else:
+        # Additional audience selection
+        if message_text == DONE_SELECTION:
+            if not form_state.answers.get('audience'):
                 await update.message.reply_text(
-                    f"❌ Error creating task: {str(e)}",
-                    reply_markup=get_keyboard_markup(['📝 Create Task', '📄 Empty ticket'])
+                    "Please select at least one audience option.",
+                    reply_markup=KB_AUDIENCE
                 )
-                user_states[user_id] = {}
+                return
+            form_state.save_state()
+            form_state.selected_audience = True
+            is_user_audience = "Users" in form_state.answers['audience']
+            form_state.comm_types = USER_COMMUNICATION_TYPES_SET if is_user_audience else DRIVER_COMMUNICATION_TYPES_SET
+            form_state.comm_kb = KB_USER_COMMS if is_user_audience else KB_DRIVER_COMMS
+            await send_md(update, "*Select regions:*\nSelect one option:", KB_REGION)
             return
-    
-    # Existing code for regular task creation
-    if message_text == "📝 Create Task":
-        # Initialize new form state
-        form_state = FormState()
-        user_states[user_id] = {
-            'form_state': form_state,
-            'state': 'collecting_data'
-        }
-        # Start with audience selection
+        elif message_text in AUDIENCE_CLEAN_BY_EMOJI:
+            clean_text = AUDIENCE_CLEAN_BY_EMOJI[message_text]
+            if clean_text not in form_state.answers['audience']:
+                form_state.save_state()
+                form_state.set_answer('audience', form_state.answers['audience'] + [clean_text])
+            await reply_selected(update, message_text)
+            return
+
+async def handle_region(update: Update, form_state: FormState, message_text: str):
+    """Handle region selection"""
+    if message_text in REGION_CLEAN_BY_EMOJI:
+        form_state.save_state()
+        clean_text = REGION_CLEAN_BY_EMOJI[message_text]
+        form_state.selected_region = clean_text
+        form_state.set_answer('region', clean_text)
+        
+        # Set up questions queue right after region selection
+        if clean_text == "All regions":
+            form_state.set_questions(_QUEUE_ALL)
+        else:
+            form_state.set_questions(_QUEUE_REGION)
+        
+        # Start asking questions
+        next_question = form_state.get_next_question()
+        await send_md_bold(update, next_question, KB_NAV_ONLY)
+        return
+    else:
         await update.message.reply_text(
-            "*For what audience is the communication planned?*\nSelect one or more options:",
-            parse_mode='Markdown',
-            reply_markup=get_keyboard_markup(AUDIENCE_CHOICES + [DONE_SELECTION] + NAVIGATION_BUTTONS)
+            "Please select a region from the list.",
+            reply_markup=KB_REGION
         )
         return
 
-    if user_id not in user_states or 'form_state' not in user_states[user_id]:
-        await start(update, context)
+async def handle_communication_types(update: Update, form_state: FormState, message_text: str):
+    """Handle the communication types question"""
+    comm_kb = form_state.comm_kb
+    if not form_state.awaiting_communication_types:
+        form_state.save_state()
+        form_state.awaiting_communication_types = True
+        await send_md(update, "*Select communication types:*\nYou can select multiple options:", comm_kb)
+        return
+    elif message_text == DONE_SELECTION:
+        if not form_state.communication_types:
+            await update.message.reply_text(
+                "Please select at least one communication type.",
+                reply_markup=comm_kb
+            )
+            return
+        form_state.save_state()
+        form_state.set_answer(form_state.current_question, form_state.communication_types)
+        form_state.awaiting_communication_types = False
+        
+        # After all questions are answered, ask for deadline
+        form_state.awaiting_deadline = True
+        await send_md(
+            update,
+            "*Select deadline:*",
+            create_calendar_keyboard(form_state.current_calendar_year, form_state.current_calendar_month)
+        )
+        return
+        
+    elif message_text in form_state.comm_types:
+        clean_text = message_text  # Keep emoji for communication types
+        if clean_text not in form_state.communication_types:
+            form_state.save_state()
+            form_state.communication_types += (clean_text,)
+        await reply_selected(update, message_text)
         return
 
-    form_state: FormState = user_states[user_id]['form_state']
-    state = user_states[user_id]['state']
+async def handle_question(update: Update, form_state: FormState, message_text: str):
+    """Record the answer to the current question and ask the next one"""
+    if form_state.current_question:
+        form_state.save_state()
+        form_state.set_answer(form_state.current_question, message_text)
+    
+    next_question = form_state.get_next_question()
+    if next_question:
+        if next_question == FINAL_QUESTIONS[1]:  # Communication types question
+            form_state.awaiting_communication_types = True
+            await send_md(
+                update,
+                "*Select communication types:*\nYou can select multiple options:",
+                form_state.comm_kb
+            )
+        else:
+            await send_md_bold(update, next_question, KB_NAV_ONLY)
+        return
 
-    if state == 'collecting_data':
-        if not form_state.selected_audience and 'audience' not in form_state.answers:
-            # Initial audience selection
-            if message_text in AUDIENCE_CHOICES:
-                form_state.save_state()
-                clean_text = ' '.join(message_text.split()[1:])
-                form_state.answers['audience'] = [clean_text]
-                await update.message.reply_text(
-                    f"Selected: {message_text}\nYou can select more or click '{DONE_SELECTION}'",
-                    reply_markup=get_keyboard_markup(AUDIENCE_CHOICES + [DONE_SELECTION] + NAVIGATION_BUTTONS)
-                )
-                return
-        elif not form_state.selected_audience:
-            # Additional audience selection
-            if message_text == DONE_SELECTION:
-                if not form_state.answers.get('audience'):
-                    await update.message.reply_text(
-                        "Please select at least one audience option.",
-                        reply_markup=get_keyboard_markup(AUDIENCE_CHOICES + [DONE_SELECTION] + NAVIGATION_BUTTONS)
-                    )
-                    return
-                form_state.save_state()
-                form_state.selected_audience = True
-                await update.message.reply_text(
-                    "*Select regions:*\nSelect one option:",
-                    parse_mode='Markdown',
-                    reply_markup=get_keyboard_markup(REGION_CHOICES + NAVIGATION_BUTTONS)
-                )
-                return
-            elif message_text in AUDIENCE_CHOICES:
-                clean_text = ' '.join(message_text.split()[1:])
-                if clean_text not in form_state.answers['audience']:
-                    form_state.save_state()
-                    form_state.answers['audience'].append(clean_text)
-                await update.message.reply_text(
-                    f"Selected: {message_text}\nYou can select more or click '{DONE_SELECTION}'",
-                    reply_markup=get_keyboard_markup(AUDIENCE_CHOICES + [DONE_SELECTION] + NAVIGATION_BUTTONS)
-                )
-                return
+# Form handlers by the question being answered, audience and region come first
+FORM_STEP_HANDLERS = {
+    'audience': handle_audience,
+    'region': handle_region,
+    FINAL_QUESTIONS[1]: handle_communication_types
+}
 
-        elif not form_state.selected_region:
-            # Handling region selection
-            if message_text in REGION_CHOICES:
-                form_state.save_state()
-                clean_text = ' '.join(message_text.split()[1:])
-                form_state.selected_region = clean_text
-                form_state.answers['region'] = clean_text
-                
-                # Set up questions queue right after region selection
-                if clean_text == "All regions":
-                    form_state.questions_queue = COMMON_QUESTIONS.copy() + FINAL_QUESTIONS.copy()
-                else:
-                    form_state.questions_queue = REGION_SPECIFIC_QUESTIONS.copy() + COMMON_QUESTIONS.copy() + FINAL_QUESTIONS.copy()
-                
-                # Start asking questions
-                next_question = form_state.get_next_question()
-                await update.message.reply_text(
-                    f"*{next_question}*",
-                    parse_mode='Markdown',
-                    reply_markup=get_keyboard_markup(NAVIGATION_BUTTONS)
-                )
-                return
-            else:
-                await update.message.reply_text(
-                    "Please select a region from the list.",
-                    reply_markup=get_keyboard_markup(REGION_CHOICES + NAVIGATION_BUTTONS)
-                )
-                return
+async def handle_collecting_data(update: Update, context: ContextTypes.DEFAULT_TYPE, session: dict, message_text: str):
+    """Handle answers while the regular task form is being filled in"""
+    form_state: FormState = session['form_state']
+    if not form_state.selected_audience:
+        step = 'audience'
+    elif not form_state.selected_region:
+        step = 'region'
+    else:
+        step = form_state.current_question
+    step_handler = FORM_STEP_HANDLERS.get(step, handle_question)
+    await step_handler(update, form_state, message_text)
 
-        elif form_state.current_question == FINAL_QUESTIONS[1]:  # Communication types question
-            if not form_state.awaiting_communication_types:
-                form_state.save_state()
-                form_state.awaiting_communication_types = True
-                comm_types = USER_COMMUNICATION_TYPES if "Users" in form_state.answers.get('audience', []) else DRIVER_COMMUNICATION_TYPES
-                await update.message.reply_text(
-                    "*Select communication types:*\nYou can select multiple options:",
-                    parse_mode='Markdown',
-                    reply_markup=get_keyboard_markup(comm_types + [DONE_SELECTION] + NAVIGATION_BUTTONS)
-                )
-                return
-            elif message_text == DONE_SELECTION:
-                if not form_state.communication_types:
-                    await update.message.reply_text(
-                        "Please select at least one communication type.",
-                        reply_markup=get_keyboard_markup(
-                            (USER_COMMUNICATION_TYPES if "Users" in form_state.answers.get('audience', []) else DRIVER_COMMUNICATION_TYPES) +
-                            [DONE_SELECTION] + NAVIGATION_BUTTONS
-                        )
-                    )
-                    return
-                form_state.save_state()
-                form_state.answers[form_state.current_question] = ", ".join(form_state.communication_types)
-                form_state.awaiting_communication_types = False
-                
-                # After all questions are answered, ask for deadline
-                form_state.awaiting_deadline = True
-                await update.message.reply_text(
-                    "*Select deadline:*",
-                    parse_mode='Markdown',
-                    reply_markup=create_calendar_keyboard(form_state.current_calendar_year, form_state.current_calendar_month)
-                )
-                return
-                
-            elif message_text in (USER_COMMUNICATION_TYPES if "Users" in form_state.answers.get('audience', []) else DRIVER_COMMUNICATION_TYPES):
-                form_state.save_state()
-                clean_text = message_text  # Keep emoji for communication types
-                if clean_text not in form_state.communication_types:
-                    form_state.communication_types.append(clean_text)
-                await update.message.reply_text(
-                    f"Selected: {message_text}\nYou can select more or click '{DONE_SELECTION}'",
-                    reply_markup=get_keyboard_markup(
-                        (USER_COMMUNICATION_TYPES if "Users" in form_state.answers.get('audience', []) else DRIVER_COMMUNICATION_TYPES) +
-                        [DONE_SELECTION] + NAVIGATION_BUTTONS
-                    )
-                )
-                return
+# Buttons that work the same way from any state
+GLOBAL_BUTTONS = {
+    "❌ Cancel": cancel,
+    "📄 Empty ticket": start_empty_ticket,
+    "📝 Create Task": start_task_form
+}
 
-        else:
-            # Handling questions
-            if form_state.current_question:
-                form_state.save_state()
-                form_state.answers[form_state.current_question] = message_text
-            
-            next_question = form_state.get_next_question()
-            if next_question:
-                if next_question == FINAL_QUESTIONS[1]:  # Communication types question
-                    form_state.awaiting_communication_types = True
-                    comm_types = USER_COMMUNICATION_TYPES if "Users" in form_state.answers.get('audience', []) else DRIVER_COMMUNICATION_TYPES
-                    await update.message.reply_text(
-                        "*Select communication types:*\nYou can select multiple options:",
-                        parse_mode='Markdown',
-                        reply_markup=get_keyboard_markup(comm_types + [DONE_SELECTION] + NAVIGATION_BUTTONS)
-                    )
-                else:
-                    await update.message.reply_text(
-                        f"*{next_question}*",
-                        parse_mode='Markdown',
-                        reply_markup=get_keyboard_markup(NAVIGATION_BUTTONS)
-                    )
-                return
+# Message handlers by (state, step) of the user's session
+MESSAGE_HANDLERS = {
+    ('creating_empty_ticket', 'name'): handle_empty_ticket_name,
+    ('creating_empty_ticket', 'description'): handle_empty_ticket_description,
+    ('collecting_data', None): handle_collecting_data
+}
 
-async def setup_application():
-    """Initialize and return the Application instance"""
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-    await application.initialize()
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    message_text = update.message.text
+    
+    # Handle navigation and menu buttons
+    button_handler = GLOBAL_BUTTONS.get(message_text)
+    if button_handler:
+        await button_handler(update, context)
+        return
+    elif message_text == "⬅️ Go back":
+        if await handle_back(update, context):
+            return
+    
+    session = get_user_state(user_id)
+    message_handler = MESSAGE_HANDLERS.get((session.get('state'), session.get('step'))) if session else None
+    if message_handler is None:
+        await start(update, context)
+        return
+    await message_handler(update, context, session, message_text)
+
+def setup_application() -> Application:
+    """Build the Application and register its handlers"""
+    # One keep-alive connection pool to api.telegram.org for the container's lifetime
+    telegram_request = HTTPXRequest(connection_pool_size=8, pool_timeout=5.0, http_version="1.1")
+    application = Application.builder().token(TELEGRAM_TOKEN).request(telegram_request).build()
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("cancel", cancel))
     application.add_handler(CallbackQueryHandler(callback_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     return application
 
+# The Application, its HTTP clients and the event loop they are bound to are
+# created once per container and reused by every warm invocation. The Application
+# is built on the first invocation, so a missing or invalid token is reported by
+# the handler as a 500 instead of failing the import.
+application: Application = None
+if uvloop is not None:
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+_LOOP = asyncio.new_event_loop()
+asyncio.set_event_loop(_LOOP)
+_app_ready = False
+UPDATE_ACK_TIMEOUT = 10  # Seconds to work on an update before acknowledging it to Telegram
+_pending_updates = set()  # Updates still running after their webhook call was acknowledged
+
+async def initialize_application():
+    """Build and initialize the Application and open the Tracker session"""
+    global application
+    if application is None:
+        application = setup_application()
+    await application.initialize()
+    await YandexTracker.open_session()
+
+async def shutdown_application():
+    """Close the Tracker session and shut the Application down"""
+    await YandexTracker.close_session()
+    await application.shutdown()
+
+@atexit.register
+def _close_application():
+    """Release the Application and the loop when the container stops"""
+    if _pending_updates:
+        # Let acknowledged updates finish before their clients are closed
+        _LOOP.run_until_complete(asyncio.wait(_pending_updates, timeout=UPDATE_ACK_TIMEOUT))
+    if _app_ready:
+        _LOOP.run_until_complete(shutdown_application())
+    _LOOP.close()
+
 async def process_telegram_update(update_dict: dict):
     """Process Telegram update asynchronously"""
-    app = await setup_application()
-    update = Update.de_json(update_dict, app.bot)
-    await app.process_update(update)
-    await app.shutdown()
+    update = Update.de_json(update_dict, application.bot)
+    await application.process_update(update)
+
+async def dispatch_telegram_update(update_dict: dict):
+    """Process the update, returning once it is done or UPDATE_ACK_TIMEOUT has passed"""
+    task = asyncio.ensure_future(process_telegram_update(update_dict))
+    _pending_updates.add(task)
+    task.add_done_callback(_pending_updates.discard)
+    done, _ = await asyncio.wait({task}, timeout=UPDATE_ACK_TIMEOUT)
+    if not done:
+        logger.warning("Update %s is still being processed, acknowledging it anyway", update_dict.get('update_id'))
+    elif task.exception():
+        # Telegram would only deliver the same update again, so it is acknowledged anyway
+        logger.error("Error processing update %s: %s", update_dict.get('update_id'), task.exception())
+
+def is_telegram_request(event) -> bool:
+    """Check the secret token Telegram sends with every webhook call, if one is configured"""
+    if not WEBHOOK_SECRET:
+        return True
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    token = request_headers.get('x-telegram-bot-api-secret-token', '')
+    # Bytes, since compare_digest raises TypeError on non-ASCII str
+    return hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode())
 
 def handler(event, context):
     """Cloud Functions handler"""
-    current_time = get_current_time_utc()
-    logger.info(f"Handler started at {current_time}")
+    global _app_ready
     
     headers = {
         'Access-Control-Allow-Origin': '*',
@@ -858,13 +1137,25 @@ def handler(event, context):
             'body': ''
         }
     
+    # The formatter renders the datetime only if the record is emitted
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Handler started at %s", datetime.now(timezone.utc))
+    
+    if not is_telegram_request(event):
+        logger.warning("Rejected webhook call with an invalid secret token")
+        return {
+            'statusCode': 403,
+            'headers': headers,
+            'body': 'Forbidden'
+        }
+    
     try:
         if "body" in event:
-            update_dict = json.loads(event["body"])
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(process_telegram_update(update_dict))
-            loop.close()
+            update_dict = orjson.loads(event["body"])  # Accepts str and bytes bodies
+            if not _app_ready:
+                _LOOP.run_until_complete(initialize_application())
+                _app_ready = True
+            _LOOP.run_until_complete(dispatch_telegram_update(update_dict))
             
             return {
                 'statusCode': 200,
@@ -879,7 +1170,7 @@ def handler(event, context):
             }
             
     except Exception as e:
-        logger.error(f"Error in handler: {str(e)}")
+        logger.error("Error in handler: %s", e)
         return {
             'statusCode': 500,
             'headers': headers,